@@ -24,6 +24,8 @@ setup(name='pipelinewise-tap-mysql',
           'mysql-replication==0.21',
           'pyyaml==5.3',
           'plpygis==0.2.0',
+          'orjson==3.6.*',
+          'zstandard==0.15.*',
       ],
       extras_require={
           'test': [
@@ -87,7 +87,9 @@ class MySQLConnection(pymysql.connections.Connection):
             "port": int(config["port"]),
             "cursorclass": config.get("cursorclass") or pymysql.cursors.SSCursor,
             "connect_timeout": CONNECT_TIMEOUT_SECONDS,
-            "charset": "utf8",
+            # let the driver decode text columns, utf8mb4 covers every unicode character
+            "charset": "utf8mb4",
+            "use_unicode": True,
         }
 
         ssl_arg = None
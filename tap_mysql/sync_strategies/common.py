@@ -3,11 +3,17 @@
 import os
 import copy
 import datetime
+import functools
+import logging
 import singer
 import time
 import json
 import uuid
+import orjson
+import zstandard
 
+from concurrent import futures
+from datetime import timezone
 from pathlib import Path
 from singer import metadata, utils, metrics
 
@@ -17,6 +23,16 @@ LOGGER = singer.get_logger('tap_mysql')
 
 HOME = str(Path.home())
 DEFAULT_FAST_SYNC_PATH = os.path.join(HOME, '.pipelinewise/tap_mysql_fast_sync_tmp/', str(uuid.uuid4()))
+BATCH_FILE_BUFFER_SIZE = 4 * 1024 * 1024
+BATCH_FILE_EXTENSIONS = {'none': '.jsonl', 'zstd': '.jsonl.zst'}
+EPOCH = datetime.datetime.fromtimestamp(0, timezone.utc)
+
+# Metadata maps by id of the metadata list. The list itself is kept
+# alongside its map so that its id cannot be reused by another list.
+_MD_MAP_CACHE = {}
+
+# Batch file directories already created during this run
+_ENSURED_DIRS = set()
 
 
 def escape(string):
@@ -38,15 +54,26 @@ def get_stream_version(tap_stream_id, state):
     return stream_version
 
 
+def get_md_map(catalog_entry):
+    """Returns the metadata map of a catalog entry, built only once per metadata list."""
+    md_list = catalog_entry.metadata
+    cached = _MD_MAP_CACHE.get(id(md_list))
+
+    if cached is None:
+        cached = _MD_MAP_CACHE[id(md_list)] = (md_list, metadata.to_map(md_list))
+
+    return cached[1]
+
+
 def stream_is_selected(stream):
-    md_map = metadata.to_map(stream.metadata)
+    md_map = get_md_map(stream)
     selected_md = metadata.get(md_map, (), 'selected')
 
     return selected_md
 
 
 def property_is_selected(stream, property_name):
-    md_map = metadata.to_map(stream.metadata)
+    md_map = get_md_map(stream)
     return singer.should_sync_field(
         metadata.get(md_map, ('properties', property_name), 'inclusion'),
         metadata.get(md_map, ('properties', property_name), 'selected'),
@@ -54,30 +81,25 @@ def property_is_selected(stream, property_name):
 
 
 def get_is_view(catalog_entry):
-    md_map = metadata.to_map(catalog_entry.metadata)
+    md_map = get_md_map(catalog_entry)
 
     return md_map.get((), {}).get('is-view')
 
 
 def get_database_name(catalog_entry):
-    md_map = metadata.to_map(catalog_entry.metadata)
+    md_map = get_md_map(catalog_entry)
 
     return md_map.get((), {}).get('database-name')
 
 
-def generate_select_sql(catalog_entry, columns):
-    database_name = get_database_name(catalog_entry)
-    escaped_db = escape(database_name)
-    escaped_table = escape(catalog_entry.table)
+@functools.lru_cache(maxsize=1024)
+def _escaped_projection(columns, property_formats):
     escaped_columns = []
 
-    for idx, col_name in enumerate(columns):
+    for col_name, property_format in zip(columns, property_formats):
         # wrap the column name in "`"
         escaped_col = escape(col_name)
 
-        # fetch the column type format from the json schema already built
-        property_format = catalog_entry.schema.properties[col_name].format
-
         # if the column format is binary, fetch the values after removing any trailing
         # null bytes 0x00 and hexifying the column.
         if 'binary' == property_format:
@@ -89,51 +111,95 @@ def generate_select_sql(catalog_entry, columns):
         else:
             escaped_columns.append(escaped_col)
 
-    select_sql = f'SELECT {",".join(escaped_columns)} FROM {escaped_db}.{escaped_table}'
+    return ",".join(escaped_columns)
+
+
+def generate_select_sql(catalog_entry, columns):
+    database_name = get_database_name(catalog_entry)
+    escaped_db = escape(database_name)
+    escaped_table = escape(catalog_entry.table)
+
+    # fetch the column type formats from the json schema already built
+    property_formats = tuple(catalog_entry.schema.properties[col_name].format for col_name in columns)
+    projection = _escaped_projection(tuple(columns), property_formats)
+
+    select_sql = f'SELECT {projection} FROM {escaped_db}.{escaped_table}'
 
     # escape percent signs
     select_sql = select_sql.replace('%', '%%')
     return select_sql
 
 
-def row_to_singer_record(catalog_entry, version, row, columns, time_extracted):
-    row_to_persist = ()
-    for idx, elem in enumerate(row):
-        property_type = catalog_entry.schema.properties[columns[idx]].type
-        property_format = catalog_entry.schema.properties[columns[idx]].format
+def _conv_datetime(elem):
+    # values are in UTC because of the session time_zone
+    return elem.replace(tzinfo=timezone.utc).isoformat()
+
+
+def _conv_date(elem):
+    return f'{elem.isoformat()}T00:00:00+00:00'
+
+
+def _conv_timedelta_time(elem):
+    # this should convert time column into 'HH:MM:SS' formatted string
+    return str(elem)
+
+
+def _conv_timedelta_epoch(elem):
+    timedelta_from_epoch = EPOCH + elem
+    return timedelta_from_epoch.isoformat()
+
+
+def _conv_bool(elem):
+    if elem is None:
+        return None
+    return elem != 0 and elem != b'\x00'
 
-        if isinstance(elem, datetime.datetime):
-            row_to_persist += (elem.isoformat() + '+00:00',)
 
-        elif isinstance(elem, datetime.date):
-            row_to_persist += (elem.isoformat() + 'T00:00:00+00:00',)
+def _identity(elem):
+    return elem
 
-        elif isinstance(elem, datetime.timedelta):
-            if property_format == 'time':
-                row_to_persist += (str(elem),) # this should convert time column into 'HH:MM:SS' formatted string
-            else:
-                epoch = datetime.datetime.utcfromtimestamp(0)
-                timedelta_from_epoch = epoch + elem
-                row_to_persist += (timedelta_from_epoch.isoformat() + '+00:00',)
 
-        elif 'boolean' in property_type or property_type == 'boolean':
-            if elem is None:
-                boolean_representation = None
-            elif elem == 0 or elem == b'\x00':
-                boolean_representation = False
-            else:
-                boolean_representation = True
-            row_to_persist += (boolean_representation,)
+def _temporal_converter(timedelta_converter):
+    converters_by_type = {
+        datetime.datetime: _conv_datetime,
+        datetime.date: _conv_date,
+        datetime.timedelta: timedelta_converter,
+    }
 
+    def convert(elem):
+        return converters_by_type.get(type(elem), _identity)(elem)
+
+    return convert
+
+
+def build_converters(catalog_entry, columns):
+    """
+    Returns a list of functions converting each column value to its singer representation.
+    Columns whose values are used as they are get None instead of a function.
+    """
+    converters = []
+    for col_name in columns:
+        property_type = catalog_entry.schema.properties[col_name].type
+        property_format = catalog_entry.schema.properties[col_name].format
+
+        is_boolean = property_type == 'boolean' or \
+            (isinstance(property_type, (list, tuple)) and 'boolean' in property_type)
+
+        if is_boolean:
+            converters.append(_conv_bool)
+        elif property_format == 'date-time':
+            converters.append(_temporal_converter(_conv_timedelta_epoch))
+        elif property_format == 'time':
+            converters.append(_temporal_converter(_conv_timedelta_time))
         else:
-            row_to_persist += (elem,)
-    rec = dict(zip(columns, row_to_persist))
+            converters.append(None)
+
+    return converters
+
 
-    return singer.RecordMessage(
-        stream=catalog_entry.stream,
-        record=rec,
-        version=version,
-        time_extracted=time_extracted)
+def row_to_record(row, columns, converters):
+    return {col_name: elem if conv is None else conv(elem)
+            for col_name, conv, elem in zip(columns, converters, row)}
 
 
 def whitelist_bookmark_keys(bookmark_key_set, tap_stream_id, state):
@@ -143,57 +209,232 @@ def whitelist_bookmark_keys(bookmark_key_set, tap_stream_id, state):
         singer.clear_bookmark(state, tap_stream_id, bookmark_key)
 
 
-def get_new_batch_file_path(table_name, file_index, base_path=DEFAULT_FAST_SYNC_PATH):
-    file_name = table_name + '_' + str(file_index).zfill(6) + '.jsonl'
+def get_new_batch_file_path(table_name, file_index, base_path=DEFAULT_FAST_SYNC_PATH, compression='none'):
+    file_name = f'{table_name}_{file_index:06d}{BATCH_FILE_EXTENSIONS[compression]}'
     base_path = os.path.join(
         base_path, table_name
     )
-    if not os.path.exists(base_path):
-        os.makedirs(base_path)
-    return os.path.join(base_path, file_name)
+    if base_path not in _ENSURED_DIRS:
+        os.makedirs(base_path, exist_ok=True)
+        _ENSURED_DIRS.add(base_path)
+    return f'{base_path}{os.sep}{file_name}'
 
 
-def update_bookmark(record_message, replication_method, catalog_entry, state):
-    if replication_method in ('FULL_TABLE', 'LOG_BASED'):
+def open_batch_file(file_path, compression='none'):
+    file = open(file_path, 'wb', buffering=BATCH_FILE_BUFFER_SIZE)
+    if compression == 'zstd':
+        # closing the compression writer closes the underlying file too
+        file = zstandard.ZstdCompressor(level=3, threads=-1).stream_writer(file)
+    return file
+
 
-        key_properties = get_key_properties(catalog_entry)
+def _clone_state(state):
+    # A JSON round trip is a lot cheaper than deepcopy for the plain dicts held in the state
+    try:
+        return json.loads(json.dumps(state))
+    except TypeError:
+        # values like Decimal are not JSON serializable by the standard library
+        return copy.deepcopy(state)
+
+
+def get_bookmark_ctx(replication_method, catalog_entry, state):
+    """Returns the bookmark settings that stay the same during the sync of a stream."""
+    key_properties = None
+    replication_key = None
+
+    if replication_method in ('FULL_TABLE', 'LOG_BASED'):
         max_pk_values = singer.get_bookmark(
             state, catalog_entry.tap_stream_id, 'max_pk_values'
         )
         if max_pk_values:
-            last_pk_fetched = {
-                k:v for k, v in record_message.record.items()
-                if k in key_properties
-            }
-            state = singer.write_bookmark(
-                state, catalog_entry.tap_stream_id,
-                'last_pk_fetched', last_pk_fetched
-            )
+            key_properties = get_key_properties(catalog_entry)
 
     elif replication_method == 'INCREMENTAL':
-
         replication_key = singer.get_bookmark(
             state, catalog_entry.tap_stream_id, 'replication_key'
         )
-        if replication_key is not None:
-            state = singer.write_bookmark(
-                state, catalog_entry.tap_stream_id,
-                'replication_key', replication_key
-            )
-
-            state = singer.write_bookmark(
-                state, catalog_entry.tap_stream_id,
-                'replication_key_value', record_message.record[replication_key]
-            )
+
+    return {
+        'tap_stream_id': catalog_entry.tap_stream_id,
+        'key_properties': key_properties,
+        'replication_key': replication_key,
+    }
+
+
+def update_bookmark(record, bookmark_ctx, state):
+    key_properties = bookmark_ctx['key_properties']
+    replication_key = bookmark_ctx['replication_key']
+
+    # The stream bookmark already exists if either setting was found in the state
+    if key_properties is not None:
+        state['bookmarks'][bookmark_ctx['tap_stream_id']]['last_pk_fetched'] = {
+            k: record[k] for k in key_properties if k in record
+        }
+
+    elif replication_key is not None:
+        state['bookmarks'][bookmark_ctx['tap_stream_id']]['replication_key_value'] = record[replication_key]
+
     return state
 
 
+def write_record_messages(config, cursor, counter, catalog_entry, columns, converters, stream_version,
+                          time_extracted, bookmark_ctx, state):
+    fetch_size = config.get('fetch_size', 10000)  # Rows to read from cursor at once
+    state_message_interval = config.get('state_message_interval', 10000)  # Rows between state messages
+    stream_name = catalog_entry.stream
+    rows_saved = 0
+
+    # Only the last record written matters for the bookmark, so it is
+    # updated when a state message is sent instead of for every row
+    last_rec = None
+    try:
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+
+            for row in rows:
+                # Write row
+                counter.increment()
+                rows_saved += 1
+                rec = row_to_record(row, columns, converters)
+                singer.write_message(singer.RecordMessage(
+                    stream=stream_name,
+                    record=rec,
+                    version=stream_version,
+                    time_extracted=time_extracted
+                ))
+                last_rec = rec
+
+                if rows_saved % state_message_interval == 0:
+                    # Update bookmark
+                    update_bookmark(last_rec, bookmark_ctx, state)
+                    singer.write_message(singer.StateMessage(value=_clone_state(state)))
+    finally:
+        # Bookmark the last record written, even if the sync failed
+        if last_rec is not None:
+            update_bookmark(last_rec, bookmark_ctx, state)
+
+
+def write_batch_records(file, rows, counter, catalog_entry, columns, converters, stream_version,
+                        time_extracted_str):
+    """Writes the rows to a json lines batch file and returns the last record."""
+    # Collect the records in a buffer to write them in large blocks
+    buffer = bytearray()
+    rec = None
+    for row in rows:
+        rec = row_to_record(row, columns, converters)
+        # Same fields as singer.RecordMessage.asdict() without creating a message per row
+        buffer += orjson.dumps({
+            'type': 'RECORD',
+            'stream': catalog_entry.stream,
+            'record': rec,
+            'version': stream_version,
+            'time_extracted': time_extracted_str
+        })
+        buffer += b'\n'
+        if len(buffer) >= BATCH_FILE_BUFFER_SIZE:
+            file.write(buffer)
+            del buffer[:]
+        # Increment counters
+        counter.increment()
+    file.write(buffer)
+
+    return rec
+
+
+def write_batch_message(catalog_entry, file_path, compression, batch_size, tic):
+    time_taken = time.perf_counter() - tic
+    LOGGER.info(f"{batch_size} records written to file '{file_path}' in {time_taken}s")
+    # Files are expected to be uncompressed when the BATCH message has no compression
+    singer.write_message(
+        singer.BatchMessage(
+            stream=catalog_entry.stream,
+            filepath=file_path,
+            compression=None if compression == 'none' else compression,
+            batch_size=batch_size
+        )
+    )
+
+
+def write_batch_files(config, cursor, counter, catalog_entry, columns, converters, stream_version,
+                      time_extracted, bookmark_ctx, state):
+    batch_cursor_size = config.get('batch_cursor_size', 500000)  # Rows to read from cursor
+    write_batch_rows = config.get('batch_size', batch_cursor_size * 2)  # rows to write to file
+    batch_rows_saved = 0
+    batch_file_index = 0
+    compression = config.get('batch_compression', 'zstd')
+    if compression not in BATCH_FILE_EXTENSIONS:
+        raise Exception(f"Unsupported batch_compression '{compression}', "
+                        f"must be one of {', '.join(BATCH_FILE_EXTENSIONS)}")
+    time_extracted_str = utils.strftime(time_extracted)
+
+    # Open first file
+    tic = time.perf_counter()
+    file_path = get_new_batch_file_path(catalog_entry.table, batch_file_index,
+                                        compression=compression)
+    file = open_batch_file(file_path, compression)
+    batch_file_index += 1
+
+    def write_rows(rows):
+        nonlocal tic, file, file_path, batch_file_index, batch_rows_saved
+
+        rec = write_batch_records(file, rows, counter, catalog_entry, columns, converters,
+                                  stream_version, time_extracted_str)
+        batch_rows_saved += len(rows)
+        # Bookmark the last record of the block
+        update_bookmark(rec, bookmark_ctx, state)
+
+        # If we have reached our write_batch_rows limit,
+        # start a new file emit the BATCH RECORD singer message
+        # and update the bookmarks
+        if batch_rows_saved % write_batch_rows == 0:
+            # close old file
+            file.close()
+            # Write batch record
+            write_batch_message(catalog_entry, file_path, compression, write_batch_rows, tic)
+            # start a new file
+            tic = time.perf_counter()
+            file_path = get_new_batch_file_path(catalog_entry.table, batch_file_index,
+                                                compression=compression)
+            file = open_batch_file(file_path, compression)
+            batch_file_index += 1
+            # Reset batch row counter
+            batch_rows_saved = 0
+            # write bookmark
+            singer.write_message(singer.StateMessage(value=_clone_state(state)))
+
+    # Convert, encode and write the rows in a worker thread while
+    # the next rows are fetched from the cursor. A single worker keeps
+    # the records, files and state messages in order.
+    with futures.ThreadPoolExecutor(max_workers=1) as executor:
+        pending_write = None
+        rows = cursor.fetchmany(batch_cursor_size)
+        while rows:
+            if pending_write is not None:
+                pending_write.result()
+            pending_write = executor.submit(write_rows, rows)
+            rows = cursor.fetchmany(batch_cursor_size)
+
+        if pending_write is not None:
+            pending_write.result()
+
+    # close last file if not already
+    if not file.closed:
+        file.close()
+
+    # Publish last message, if not already
+    if batch_rows_saved % write_batch_rows != 0:
+        write_batch_message(catalog_entry, file_path, compression, batch_rows_saved, tic)
+
+
 def sync_query(config, cursor, catalog_entry, state, select_sql, columns, stream_version, params):
 
-    query_string = cursor.mogrify(select_sql, params)
     time_extracted = utils.now()
 
-    LOGGER.info('Running %s', query_string)
+    # mogrify builds the full query string, only do it when it is going to be logged
+    if LOGGER.isEnabledFor(logging.INFO):
+        LOGGER.info('Running %s', cursor.mogrify(select_sql, params))
     cursor.execute(select_sql, params)
 
     database_name = get_database_name(catalog_entry)
@@ -201,110 +442,18 @@ def sync_query(config, cursor, catalog_entry, state, select_sql, columns, stream
     stream_metadata = md_map.get((), {})
     replication_method = stream_metadata.get('replication-method')
     batch = config.get('batch_messages', False)
+    converters = build_converters(catalog_entry, columns)
+    bookmark_ctx = get_bookmark_ctx(replication_method, catalog_entry, state)
 
     with metrics.record_counter(None) as counter:
         counter.tags['database'] = database_name
         counter.tags['table'] = catalog_entry.table
 
-        rows_saved = 0
         if not batch:
-
-            row = cursor.fetchone()
-            while row:
-                # Write row
-                counter.increment()
-                rows_saved += 1
-                record_message = row_to_singer_record(
-                    catalog_entry,
-                    stream_version,
-                    row,
-                    columns,
-                    time_extracted
-                )
-                singer.write_message(record_message)
-
-                # Update bookmark
-                state = update_bookmark(record_message, replication_method, catalog_entry, state)
-
-                if rows_saved % 1000 == 0:
-                    singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
-
-                row = cursor.fetchone()
-
+            write_record_messages(config, cursor, counter, catalog_entry, columns, converters,
+                                  stream_version, time_extracted, bookmark_ctx, state)
         else:
-            record_message = None
-            batch_cursor_size = config.get('batch_cursor_size', 500000)  # Rows to read from cursor
-            write_batch_rows = config.get('batch_size', batch_cursor_size * 2)  # rows to write to file
-            batch_rows_saved = 0
-            batch_file_index = 0
+            write_batch_files(config, cursor, counter, catalog_entry, columns, converters,
+                              stream_version, time_extracted, bookmark_ctx, state)
 
-            # Open first file
-            tic = time.clock()
-            file_path = get_new_batch_file_path(catalog_entry.table, batch_file_index)
-            file = open(file_path, 'w')
-            batch_file_index += 1
-
-            rows = cursor.fetchmany(batch_cursor_size)
-            full_batch = (len(rows) == batch_cursor_size)
-            while rows:
-                # Write records to json lines file
-                for row in rows:
-                    record_message = row_to_singer_record(
-                        catalog_entry, stream_version,
-                        row, columns, time_extracted
-                    )
-                    file.write(json.dumps(record_message.asdict()))
-                    file.write('\n')
-                    # Increment counters
-                    counter.increment()
-                    rows_saved += 1
-                    batch_rows_saved += 1
-                    state = update_bookmark(record_message, replication_method, catalog_entry, state)
-
-                # If we have reached our write_batch_rows limit,
-                # start a new file emit the BATCH RECORD singer message
-                # and update the bookmarks
-                if batch_rows_saved % write_batch_rows == 0:
-                    # close old file
-                    file.close()
-                    time_taken = time.clock() - tic
-                    LOGGER.info(f"{batch_rows_saved} records written to file '{file_path}' in {time_taken}s")
-                    # Write batch record
-                    singer.write_message(
-                        singer.BatchMessage(
-                            stream=catalog_entry.stream,
-                            filepath=file_path,
-                            batch_size=write_batch_rows
-                        )
-                    )
-                    # start a new file
-                    tic = time.clock()
-                    file_path = get_new_batch_file_path(catalog_entry.table, batch_file_index)
-                    file = open(file_path, 'w')
-                    batch_file_index += 1
-                    # Reset batch row counter
-                    batch_rows_saved = 0
-                    # write bookmark
-                    singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
-
-                rows = cursor.fetchmany(batch_cursor_size)
-                full_batch = (len(rows) == batch_cursor_size)
-
-            # close last file if not already
-            if not file.closed:
-                file.close()
-
-            # Publish last message, if not already
-            if batch_rows_saved % write_batch_rows != 0:
-                time_taken = time.clock() - tic
-                LOGGER.info(f"{batch_rows_saved} records written to file '{file_path}' in {time_taken}s")
-                # Write batch record
-                singer.write_message(
-                    singer.BatchMessage(
-                        stream=catalog_entry.stream,
-                        filepath=file_path,
-                        batch_size=batch_rows_saved
-                    )
-                )
-
-    singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
+    singer.write_message(singer.StateMessage(value=_clone_state(state)))
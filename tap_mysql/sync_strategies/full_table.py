@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 # pylint: disable=too-many-locals,missing-function-docstring
 
+import functools
 import singer
 
 from singer import metadata
@@ -89,7 +90,7 @@ def get_max_pk_values(cursor, catalog_entry):
     return max_pk_values
 
 
-def generate_pk_clause(catalog_entry, state):
+def generate_pk_clause(catalog_entry, state, last_pk_fetched=None):
     key_properties = common.get_key_properties(catalog_entry)
     escaped_columns = [common.escape(c) for c in key_properties]
 
@@ -97,9 +98,10 @@ def generate_pk_clause(catalog_entry, state):
                                         catalog_entry.tap_stream_id,
                                         'max_pk_values')
 
-    last_pk_fetched = singer.get_bookmark(state,
-                                          catalog_entry.tap_stream_id,
-                                          'last_pk_fetched')
+    if last_pk_fetched is None:
+        last_pk_fetched = singer.get_bookmark(state,
+                                              catalog_entry.tap_stream_id,
+                                              'last_pk_fetched')
 
     if last_pk_fetched:
         pk_comparisons = ["({} > {} AND {} <= {})".format(common.escape(pk),
@@ -117,6 +119,58 @@ def generate_pk_clause(catalog_entry, state):
     return sql
 
 
+class KeysetPagingCursor:
+    """
+    Cursor wrapper running a select query in pages of primary key ranges.
+    Each page starts after the last primary key fetched by the previous one,
+    so the PK index is used to seek instead of streaming the whole table with
+    a single query. Rows are fetched from the pages as from a single query.
+    """
+
+    def __init__(self, cursor, catalog_entry, state, columns, page_size):
+        self.cursor = cursor
+        self.pk_clause = functools.partial(generate_pk_clause, catalog_entry, state)
+        self.key_positions = {pk: columns.index(pk) for pk in common.get_key_properties(catalog_entry)}
+        self.page_size = page_size
+
+        self.query = None
+        self.page_rows = 0
+        self.last_pk_fetched = None
+
+    def page_sql(self, select_sql):
+        return f'{select_sql}{self.pk_clause(self.last_pk_fetched)} LIMIT {self.page_size}'
+
+    def mogrify(self, select_sql, params):
+        return self.cursor.mogrify(self.page_sql(select_sql), params)
+
+    def execute(self, select_sql, params):
+        self.query = (select_sql, params)
+        self.page_rows = 0
+        self.cursor.execute(self.page_sql(select_sql), params)
+
+    def fetchmany(self, size):
+        rows = self.fetch_page_rows(size)
+
+        # A full page means there can be more rows after it,
+        # complete the rows from the next pages
+        while len(rows) < size and self.page_rows == self.page_size:
+            LOGGER.info("Fetching next page after primary key %s", self.last_pk_fetched)
+            self.execute(*self.query)
+            rows += self.fetch_page_rows(size - len(rows))
+
+        return rows
+
+    def fetch_page_rows(self, size):
+        rows = list(self.cursor.fetchmany(size))
+
+        if rows:
+            self.page_rows += len(rows)
+            last_row = rows[-1]
+            self.last_pk_fetched = {pk: last_row[pos] for pk, pos in self.key_positions.items()}
+
+        return rows
+
+
 def sync_table(config, mysql_conn, catalog_entry, state, columns, stream_version):
     common.whitelist_bookmark_keys(generate_bookmark_keys(catalog_entry), catalog_entry.tap_stream_id, state)
 
@@ -146,6 +200,7 @@ def sync_table(config, mysql_conn, catalog_entry, state, columns, stream_version
     with connect_with_backoff(mysql_conn) as open_conn:
         with open_conn.cursor() as cur:
             select_sql = common.generate_select_sql(catalog_entry, columns)
+            query_cursor = cur
 
             if key_props_are_auto_incrementing:
                 LOGGER.info("Detected auto-incrementing primary key(s) - will replicate incrementally")
@@ -161,14 +216,13 @@ def sync_table(config, mysql_conn, catalog_entry, state, columns, stream_version
                                                   'max_pk_values',
                                                   max_pk_values)
 
-                    pk_clause = generate_pk_clause(catalog_entry, state)
-
-                    select_sql += pk_clause
+                    page_size = int(config.get('keyset_batch', 100000))
+                    query_cursor = KeysetPagingCursor(cur, catalog_entry, state, columns, page_size)
 
             params = {}
 
             common.sync_query(
-                config, cur, catalog_entry, state, select_sql,
+                config, query_cursor, catalog_entry, state, select_sql,
                 columns, stream_version, params
             )
 
@@ -0,0 +1,106 @@
+import json
+import re
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import singer
+
+from singer.schema import Schema
+
+import tap_mysql.sync_strategies.common as common
+import tap_mysql.sync_strategies.full_table as full_table
+
+try:
+    import tests.utils as test_utils
+except ImportError:
+    import utils as test_utils
+
+
+class FakeTableCursor(test_utils.FakeCursor):
+    """Cursor selecting rows of a table by the `id` range and LIMIT of the executed query."""
+
+    def __init__(self, table_rows):
+        super().__init__([])
+        self.table_rows = table_rows
+
+    def execute(self, sql, params):
+        super().execute(sql, params)
+
+        lower = re.search(r'`id` > (\d+)', sql)
+        upper = re.search(r'`id` <= (\d+)', sql)
+        limit = re.search(r'LIMIT (\d+)', sql)
+
+        self.rows = [row for row in self.table_rows
+                     if (not lower or row[0] > int(lower.group(1)))
+                     and (not upper or row[0] <= int(upper.group(1)))]
+        if limit:
+            self.rows = self.rows[:int(limit.group(1))]
+
+
+class TestKeysetPaging(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.messages = []
+        self.columns = ['id', 'val']
+        self.catalog_entry = test_utils.make_catalog_entry({
+            'id': Schema(type=['null', 'integer']),
+            'val': Schema(type=['null', 'string']),
+        }, key_properties=['id'])
+        self.cursor = FakeTableCursor([(i, f'val_{i}') for i in range(1, 11)])
+
+        patchers = [patch('singer.write_message', self.messages.append),
+                    patch.object(common, 'get_new_batch_file_path',
+                                 test_utils.batch_file_path_in(self.base_path))]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def sync(self, config, state):
+        paging_cursor = full_table.KeysetPagingCursor(self.cursor, self.catalog_entry, state, self.columns, 3)
+        select_sql = common.generate_select_sql(self.catalog_entry, self.columns)
+        common.sync_query(config, paging_cursor, self.catalog_entry, state, select_sql, self.columns, 1, {})
+
+    def test_resume_from_last_pk_fetched_across_pages(self):
+        state = {'bookmarks': {self.catalog_entry.tap_stream_id: {'max_pk_values': {'id': 9},
+                                                                   'last_pk_fetched': {'id': 2}}}}
+
+        self.sync({'fetch_size': 2}, state)
+
+        self.assertEqual([m.record['id'] for m in self.messages if isinstance(m, singer.RecordMessage)],
+                         [3, 4, 5, 6, 7, 8, 9])
+        self.assertEqual(len(self.cursor.executed), 3)
+        self.assertIn('`id` > 2 AND `id` <= 9', self.cursor.executed[0])
+        self.assertIn('`id` > 5 AND `id` <= 9', self.cursor.executed[1])
+        self.assertIn('`id` > 8 AND `id` <= 9', self.cursor.executed[2])
+
+        # a single STATE message at the end of the query, not one per page
+        state_messages = [m for m in self.messages if isinstance(m, singer.StateMessage)]
+        self.assertEqual([m.value['bookmarks'][self.catalog_entry.tap_stream_id]['last_pk_fetched']
+                          for m in state_messages],
+                         [{'id': 9}])
+
+    def test_batch_files_span_pages(self):
+        state = {'bookmarks': {self.catalog_entry.tap_stream_id: {'max_pk_values': {'id': 10}}}}
+
+        self.sync({'batch_messages': True, 'batch_compression': 'none',
+                   'batch_cursor_size': 2, 'batch_size': 4}, state)
+
+        self.assertEqual(len(self.cursor.executed), 4)
+
+        batch_messages = [m for m in self.messages if isinstance(m, singer.BatchMessage)]
+        self.assertEqual([m.batch_size for m in batch_messages], [4, 4, 2])
+        self.assertEqual(len({m.filepath for m in batch_messages}), 3)
+
+        record_ids = []
+        for message in batch_messages:
+            with open(message.filepath, 'rb') as file:
+                record_ids.extend(json.loads(line)['record']['id'] for line in file.read().splitlines())
+        self.assertEqual(record_ids, list(range(1, 11)))
+
+        self.assertEqual(state['bookmarks'][self.catalog_entry.tap_stream_id]['last_pk_fetched'], {'id': 10})
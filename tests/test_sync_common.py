@@ -0,0 +1,237 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import singer
+import zstandard
+
+from singer.schema import Schema
+
+import tap_mysql.sync_strategies.common as common
+
+try:
+    import tests.utils as test_utils
+except ImportError:
+    import utils as test_utils
+
+
+class TestRowToRecord(unittest.TestCase):
+
+    def setUp(self):
+        self.columns = ['c_int', 'c_decimal', 'c_varchar', 'c_bool', 'c_bit',
+                        'c_datetime', 'c_date', 'c_time', 'c_binary', 'c_json']
+        self.catalog_entry = test_utils.make_catalog_entry({
+            'c_int': Schema(type=['null', 'integer']),
+            'c_decimal': Schema(type=['null', 'number']),
+            'c_varchar': Schema(type=['null', 'string']),
+            'c_bool': Schema(type=['null', 'boolean']),
+            'c_bit': Schema(type=['null', 'boolean']),
+            'c_datetime': Schema(type=['null', 'string'], format='date-time'),
+            'c_date': Schema(type=['null', 'string'], format='date-time'),
+            'c_time': Schema(type=['null', 'string'], format='time'),
+            'c_binary': Schema(type=['null', 'string'], format='binary'),
+            'c_json': Schema(type=['null', 'object']),
+        })
+
+    def row_to_record(self, row):
+        converters = common.build_converters(self.catalog_entry, self.columns)
+        return common.row_to_record(row, self.columns, converters)
+
+    def test_only_boolean_and_temporal_columns_are_converted(self):
+        converters = common.build_converters(self.catalog_entry, self.columns)
+
+        self.assertEqual(
+            [col for col, conv in zip(self.columns, converters) if conv is not None],
+            ['c_bool', 'c_bit', 'c_datetime', 'c_date', 'c_time'])
+
+    def test_values(self):
+        row = (1, 2.5, 'abc', 1, b'\x00',
+               datetime.datetime(2020, 1, 2, 3, 4, 5, 6),
+               datetime.date(2020, 1, 2),
+               datetime.timedelta(hours=12, minutes=30, seconds=5),
+               'DEADBEEF', '{"a": 1}')
+
+        self.assertEqual(self.row_to_record(row), {
+            'c_int': 1,
+            'c_decimal': 2.5,
+            'c_varchar': 'abc',
+            'c_bool': True,
+            'c_bit': False,
+            'c_datetime': '2020-01-02T03:04:05.000006+00:00',
+            'c_date': '2020-01-02T00:00:00+00:00',
+            'c_time': '12:30:05',
+            'c_binary': 'DEADBEEF',
+            'c_json': '{"a": 1}',
+        })
+
+    def test_boolean_values(self):
+        records = [self.row_to_record((None, None, None, c_bool, c_bit, None, None, None, None, None))
+                   for c_bool, c_bit in [(0, b'\x00'), (1, b'\x01'), (None, None)]]
+
+        self.assertEqual([(rec['c_bool'], rec['c_bit']) for rec in records],
+                         [(False, False), (True, True), (None, None)])
+
+    def test_null_values(self):
+        record = self.row_to_record((None,) * len(self.columns))
+
+        self.assertEqual(record, {col: None for col in self.columns})
+
+    def test_invalid_temporal_values_are_kept(self):
+        # invalid dates like zero dates are returned as strings by pymysql
+        record = self.row_to_record((None, None, None, None, None,
+                                     '0000-00-00 00:00:00', '0000-00-00', '838:59:59', None, None))
+
+        self.assertEqual(record['c_datetime'], '0000-00-00 00:00:00')
+        self.assertEqual(record['c_date'], '0000-00-00')
+        self.assertEqual(record['c_time'], '838:59:59')
+
+    def test_timedelta_in_date_time_column(self):
+        record = self.row_to_record((None, None, None, None, None,
+                                     datetime.timedelta(days=1, hours=1), None, None, None, None))
+
+        self.assertEqual(record['c_datetime'], '1970-01-02T01:00:00+00:00')
+
+
+class TestBatchMessages(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.messages = []
+        self.columns = ['id', 'val']
+        self.catalog_entry = test_utils.make_catalog_entry({
+            'id': Schema(type=['null', 'integer']),
+            'val': Schema(type=['null', 'string']),
+        })
+
+        patchers = [patch('singer.write_message', self.messages.append),
+                    patch.object(common, 'get_new_batch_file_path',
+                                 test_utils.batch_file_path_in(self.base_path))]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def sync(self, config, row_count):
+        config = {'batch_messages': True, 'batch_cursor_size': 2, 'batch_size': 4, **config}
+        cursor = test_utils.FakeCursor((i, f'val_{i}') for i in range(row_count))
+        common.sync_query(config, cursor, self.catalog_entry, {}, 'SELECT', self.columns, 1, {})
+
+    def batch_messages(self):
+        return [m for m in self.messages if isinstance(m, singer.BatchMessage)]
+
+    @staticmethod
+    def read_records(batch_message):
+        with open(batch_message.filepath, 'rb') as file:
+            if batch_message.compression == 'zstd':
+                data = zstandard.ZstdDecompressor().stream_reader(file).read()
+            else:
+                data = file.read()
+
+        return [json.loads(line) for line in data.splitlines()]
+
+    def test_zstd_batch_files(self):
+        self.sync({}, 6)
+
+        batch_messages = self.batch_messages()
+        self.assertEqual([(m.stream, m.compression, m.batch_size) for m in batch_messages],
+                         [('test_table', 'zstd', 4), ('test_table', 'zstd', 2)])
+        self.assertEqual([os.path.basename(m.filepath) for m in batch_messages],
+                         ['test_table_000000.jsonl.zst', 'test_table_000001.jsonl.zst'])
+
+        records = [rec for m in batch_messages for rec in self.read_records(m)]
+        self.assertEqual([rec['record'] for rec in records],
+                         [{'id': i, 'val': f'val_{i}'} for i in range(6)])
+        self.assertEqual({(rec['type'], rec['stream'], rec['version']) for rec in records},
+                         {('RECORD', 'test_table', 1)})
+
+    def test_uncompressed_batch_files(self):
+        self.sync({'batch_compression': 'none'}, 3)
+
+        batch_messages = self.batch_messages()
+        self.assertEqual([(m.compression, m.batch_size) for m in batch_messages], [(None, 3)])
+        self.assertEqual(os.path.basename(batch_messages[0].filepath), 'test_table_000000.jsonl')
+        self.assertEqual([rec['record']['id'] for rec in self.read_records(batch_messages[0])], [0, 1, 2])
+
+
+class TestBookmarks(unittest.TestCase):
+
+    def setUp(self):
+        self.messages = []
+        self.columns = ['id', 'updated_at']
+        self.rows = [(i, datetime.datetime(2020, 1, i)) for i in range(1, 6)]
+
+        patcher = patch('singer.write_message', self.messages.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def make_catalog_entry(replication_method):
+        return test_utils.make_catalog_entry({
+            'id': Schema(type=['null', 'integer']),
+            'updated_at': Schema(type=['null', 'string'], format='date-time'),
+        }, replication_method=replication_method, key_properties=['id'])
+
+    def sync(self, config, replication_method, bookmark):
+        catalog_entry = self.make_catalog_entry(replication_method)
+        state = {'bookmarks': {catalog_entry.tap_stream_id: bookmark}}
+        cursor = test_utils.FakeCursor(self.rows)
+
+        common.sync_query(config, cursor, catalog_entry, state, 'SELECT', self.columns, 1, {})
+
+        return state['bookmarks'][catalog_entry.tap_stream_id]
+
+    def state_bookmarks(self, key):
+        return [m.value['bookmarks']['tap_mysql_test-test_table'][key]
+                for m in self.messages if isinstance(m, singer.StateMessage)]
+
+    def test_full_table_state_messages(self):
+        bookmark = self.sync({'fetch_size': 3, 'state_message_interval': 2},
+                             'FULL_TABLE', {'max_pk_values': {'id': 5}})
+
+        self.assertEqual(self.state_bookmarks('last_pk_fetched'), [{'id': 2}, {'id': 4}, {'id': 5}])
+        self.assertEqual(bookmark['last_pk_fetched'], {'id': 5})
+
+    def test_incremental_state_messages(self):
+        bookmark = self.sync({'fetch_size': 3, 'state_message_interval': 2},
+                             'INCREMENTAL', {'replication_key': 'updated_at'})
+
+        self.assertEqual(self.state_bookmarks('replication_key_value'),
+                         ['2020-01-02T00:00:00+00:00', '2020-01-04T00:00:00+00:00',
+                          '2020-01-05T00:00:00+00:00'])
+        self.assertEqual(bookmark['replication_key_value'], '2020-01-05T00:00:00+00:00')
+
+    def test_bookmark_on_failure(self):
+        class FailingCursor(test_utils.FakeCursor):
+            def fetchmany(self, size):
+                if not self.rows:
+                    raise RuntimeError('Lost connection')
+                return super().fetchmany(size)
+
+        catalog_entry = self.make_catalog_entry('FULL_TABLE')
+        state = {'bookmarks': {catalog_entry.tap_stream_id: {'max_pk_values': {'id': 5}}}}
+
+        with self.assertRaises(RuntimeError):
+            common.sync_query({'fetch_size': 1, 'state_message_interval': 2}, FailingCursor(self.rows[:3]),
+                              catalog_entry, state, 'SELECT', self.columns, 1, {})
+
+        # the last record written is bookmarked even without a STATE message after it
+        self.assertEqual(self.state_bookmarks('last_pk_fetched'), [{'id': 2}])
+        self.assertEqual(state['bookmarks'][catalog_entry.tap_stream_id]['last_pk_fetched'], {'id': 3})
+
+    def test_batch_state_messages(self):
+        base_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_path)
+
+        with patch.object(common, 'get_new_batch_file_path', test_utils.batch_file_path_in(base_path)):
+            bookmark = self.sync({'batch_messages': True, 'batch_cursor_size': 2, 'batch_size': 4},
+                                 'FULL_TABLE', {'max_pk_values': {'id': 5}})
+
+        # a STATE message after each full batch file, bookmarked to the last record of its last block
+        self.assertEqual(self.state_bookmarks('last_pk_fetched'), [{'id': 4}, {'id': 5}])
+        self.assertEqual(bookmark['last_pk_fetched'], {'id': 5})
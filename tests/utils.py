@@ -3,6 +3,8 @@ import pymysql
 import singer
 import tap_mysql
 import tap_mysql.sync_strategies.common as common
+from singer.catalog import CatalogEntry
+from singer.schema import Schema
 from tap_mysql.connection import MySQLConnection
 
 DB_NAME='tap_mysql_test'
@@ -81,3 +83,46 @@ def set_selected(stream, selected=False):
 
     stream.metadata = singer.metadata.to_list(new_md)
     return stream
+
+
+def make_catalog_entry(properties, replication_method='FULL_TABLE', key_properties=None):
+    return CatalogEntry(
+        tap_stream_id='tap_mysql_test-test_table',
+        stream='test_table',
+        table='test_table',
+        schema=Schema(type='object', properties=properties),
+        metadata=[
+            {'breadcrumb': (),
+             'metadata': {'selected': True,
+                          'database-name': 'tap_mysql_test',
+                          'replication-method': replication_method,
+                          'table-key-properties': key_properties or []}},
+        ])
+
+
+class FakeCursor:
+    """Cursor returning the given rows, whatever query is executed."""
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.executed = []
+
+    def mogrify(self, sql, params):
+        return sql
+
+    def execute(self, sql, params):
+        self.executed.append(sql)
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+def batch_file_path_in(base_path):
+    """Returns a replacement of get_new_batch_file_path writing batch files under base_path."""
+    get_new_batch_file_path = common.get_new_batch_file_path
+
+    def get_batch_file_path(table_name, file_index, compression):
+        return get_new_batch_file_path(table_name, file_index, base_path, compression)
+
+    return get_batch_file_path